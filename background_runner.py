@@ -18,11 +18,57 @@ stdout and stderr respectively. Files are uniquely named to prevent overwriting.
 """
 import os
 import sys
+import argparse
+import asyncio
+import atexit
+import ctypes
+import glob
+import gzip
+import hashlib
+import inspect
 import logging
+import pickle
+import re
+import resource
+import select
+import shutil
+import signal
+import struct
+import threading
 import time
+import traceback
 
 logger = logging.getLogger("background_runner")
 
+# Status file layout: fixed size header followed by the pickled result of the function.
+# magic, state, pid, exit_code, start_time, end_time, progress
+# progress is the last field so the running job can update it in place with a single write.
+STATUS_HEADER = struct.Struct("<4sBqqddq")
+STATUS_MAGIC = b"BGJ1"
+PROGRESS_OFFSET = STATUS_HEADER.size - struct.calcsize("<q")
+job_states = ["queued", "running", "finished", "failed"]
+
+# Status of the job running in this (child) process, used by set_progress
+current_job = None
+
+# Checkpoint file of the job running in this (child) process, used by save_checkpoint
+current_checkpoint_file = None
+last_checkpoint_time = 0.0
+
+# I/O scheduling classes and the (ioprio_set, ioprio_get) syscall numbers per machine--there is no
+# wrapper for them in the standard library
+ioprio_classes = {"realtime": 1, "best-effort": 2, "idle": 3}
+ioprio_syscalls = {
+    "x86_64": (251, 252),
+    "i386": (289, 290),
+    "i686": (289, 290),
+    "aarch64": (30, 31),
+    "armv7l": (314, 315),
+    "ppc64le": (273, 274),
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+
 
 def get_file_no(file_handle):
     """
@@ -48,10 +94,1060 @@ def get_file_no(file_handle):
     return file_no
 
 
+def get_log_dir(log_dir="", home_subdir=""):
+    """
+    Determine the directory for the redirected stdout and stderr files
+    :param log_dir: str - full path to the directory, takes precedence over home_subdir
+    :param home_subdir: str - subdirectory within the users home directory
+    :return: str - the log directory
+    """
+    if log_dir:
+        return log_dir
+    elif home_subdir:
+        return os.path.join(os.environ["HOME"], home_subdir)
+    return os.environ["HOME"]
+
+
+def get_log_file_base(log_dir, function_name, job_number=None):
+    """
+    Determine a unique absolute path, without extension, for the files of a backgrounded job, such as
+    the .out and .err redirected stdout and stderr. Creates the log directory if needed.
+    :param log_dir: str - directory for the files
+    :param function_name: str - name of the backgrounded function
+    :param job_number: int - optional sequence number to keep names unique within the same millisecond
+    :return: str - path to append the file extension to
+    """
+    script_name = str(sys.argv[0]).rpartition(os.path.sep)[2].rpartition(".")[0]
+    log_file_base = "{}_{}_{}".format(script_name, function_name, int(time.time() * 1000))
+    if job_number is not None:
+        log_file_base += "_{}".format(job_number)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+        logger.debug("created new directory '{}'".format(log_dir))
+    return os.path.abspath(os.path.join(log_dir, log_file_base))
+
+
+def redirect_output(output_log, error_log):
+    """
+    Redirect stdout and stderr of the current process to the output and error files
+    :param output_log: str - file for stdout
+    :param error_log: str - file for stderr
+    :return: None
+    """
+    with open(output_log, "w") as file_out_fh:
+        with open(error_log, "w") as file_err_fh:
+            # determine filno for each
+            stdout_fileno = get_file_no(sys.stdout)
+            stderr_fileno = get_file_no(sys.stderr)
+            out_fileno = get_file_no(file_out_fh)
+            err_fileno = get_file_no(file_err_fh)
+            # flush out and err so we don't miss any pending messages
+            sys.stderr.flush()
+            sys.stdout.flush()
+            # redirect the sys out to the file out
+            os.dup2(out_fileno, stdout_fileno)
+            # redirect the sys err to the file err
+            os.dup2(err_fileno, stderr_fileno)
+
+
+class RotatingLog:
+    """
+    Block buffered log file that is rotated to .1, .2, ... once it reaches max_bytes. Rotated files are
+    optionally gzip compressed.
+    """
+
+    def __init__(self, path, buffer_size=65536, max_bytes=0, backups=5, compress=False):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.buffer = bytearray()
+        self.file_fh = open(path, "wb", buffering=0)
+        self.size = 0
+
+    def backup_name(self, number):
+        return "{}.{}{}".format(self.path, number, ".gz" if self.compress else "")
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.file_fh.write(self.buffer)
+        self.size += len(self.buffer)
+        self.buffer.clear()
+        if self.max_bytes and self.size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        """
+        Shift the backups up by one, dropping the oldest, and start a new empty log file
+        :return: None
+        """
+        self.file_fh.close()
+        if self.backups > 0:
+            for number in range(self.backups - 1, 0, -1):
+                if os.path.exists(self.backup_name(number)):
+                    os.replace(self.backup_name(number), self.backup_name(number + 1))
+            if self.compress:
+                with open(self.path, "rb") as log_fh:
+                    with gzip.open(self.backup_name(1), "wb", compresslevel=6) as gzip_fh:
+                        shutil.copyfileobj(log_fh, gzip_fh)
+            else:
+                os.replace(self.path, self.backup_name(1))
+        self.file_fh = open(self.path, "wb", buffering=0)
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        self.file_fh.close()
+
+
+class LogCapture:
+    """
+    Alternative to redirecting stdout and stderr straight onto the .out and .err files. Output goes
+    through pipes to a separate collector process that block buffers it, rotates the files by size and
+    optionally compresses the rotated files. The collector ignores SIGHUP, SIGINT and SIGTERM and keeps
+    draining the pipes until every writer has closed them, so output already written by the job is
+    saved even when the job crashes or is killed.
+    """
+
+    def __init__(self, buffer_size=65536, max_bytes=0, backups=5, compress=False, flush_interval=1.0):
+        """
+        :param buffer_size: int - bytes buffered per stream before writing to the file
+        :param max_bytes: int - rotate a file once it reaches this size, 0 to never rotate
+        :param backups: int - number of rotated files to keep
+        :param compress: bool - gzip rotated files
+        :param flush_interval: float - seconds after which buffered output is written even if the buffer
+                               is not full, so the files can be followed while the job runs
+        """
+        self.buffer_size = buffer_size
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.collector_pid = None
+
+    def start(self, output_log, error_log):
+        """
+        Fork the collector and redirect stdout and stderr of the current process into its pipes
+        :param output_log: str - file for stdout
+        :param error_log: str - file for stderr
+        :return: None
+        """
+        out_read, out_write = os.pipe()
+        err_read, err_write = os.pipe()
+        stdout_fileno = get_file_no(sys.stdout)
+        stderr_fileno = get_file_no(sys.stderr)
+        sys.stderr.flush()
+        sys.stdout.flush()
+        self.collector_pid = os.fork()
+        if self.collector_pid == 0:
+            exit_code = 0
+            try:
+                os.close(out_write)
+                os.close(err_write)
+                for signal_number in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+                    signal.signal(signal_number, signal.SIG_IGN)
+                # Do not hold on to the terminal or files of the job
+                with open(os.devnull, "w") as dev_null_fh:
+                    os.dup2(get_file_no(dev_null_fh), stdout_fileno)
+                    os.dup2(get_file_no(dev_null_fh), stderr_fileno)
+                self.collect({
+                    out_read: RotatingLog(output_log, self.buffer_size, self.max_bytes, self.backups, self.compress),
+                    err_read: RotatingLog(error_log, self.buffer_size, self.max_bytes, self.backups, self.compress),
+                })
+            except BaseException:
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        os.close(out_read)
+        os.close(err_read)
+        os.dup2(out_write, stdout_fileno)
+        os.dup2(err_write, stderr_fileno)
+        os.close(out_write)
+        os.close(err_write)
+        atexit.register(self.stop)
+
+    def collect(self, logs):
+        """
+        Collector loop: copy from the pipes into the logs until all pipes are closed
+        :param logs: dict - pipe file number to RotatingLog
+        :return: None
+        """
+        last_flush = time.time()
+        while logs:
+            ready, _, _ = select.select(list(logs), [], [], self.flush_interval)
+            for fileno in ready:
+                data = os.read(fileno, 65536)
+                if data:
+                    logs[fileno].write(data)
+                else:
+                    logs.pop(fileno).close()
+                    os.close(fileno)
+            if time.time() - last_flush >= self.flush_interval:
+                for log in logs.values():
+                    log.flush()
+                last_flush = time.time()
+
+    def stop(self):
+        """
+        Close the pipes of the current process and wait for the collector to write out everything
+        :return: None
+        """
+        if self.collector_pid is None:
+            return
+        sys.stderr.flush()
+        sys.stdout.flush()
+        with open(os.devnull, "w") as dev_null_fh:
+            os.dup2(get_file_no(dev_null_fh), get_file_no(sys.stdout))
+            os.dup2(get_file_no(dev_null_fh), get_file_no(sys.stderr))
+        try:
+            os.waitpid(self.collector_pid, 0)
+        except ChildProcessError:
+            pass
+        self.collector_pid = None
+
+
+def ioprio_syscall(set_value=None):
+    """
+    Set or get the I/O priority of the current process
+    :param set_value: int - (class << 13) | level to set, None to get
+    :return: int - the current value when getting
+    """
+    machine = os.uname().machine
+    if machine not in ioprio_syscalls:
+        raise OSError("I/O priority is not supported on '{}'".format(machine))
+    libc = ctypes.CDLL(None, use_errno=True)
+    set_number, get_number = ioprio_syscalls[machine]
+    if set_value is None:
+        value = libc.syscall(get_number, IOPRIO_WHO_PROCESS, 0)
+    else:
+        value = libc.syscall(set_number, IOPRIO_WHO_PROCESS, 0, set_value)
+    if value < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return value
+
+
+class JobLimits:
+    """
+    Scheduling priorities and resource limits applied to the background process so heavy jobs step
+    aside for interactive work on the same host
+    """
+
+    def __init__(self, cpus=None, nice=None, ionice=None, memory=None, cpu_time=None, open_files=None):
+        """
+        :param cpus: list of int - CPU numbers the job may run on
+        :param nice: int - increment added to the niceness of the job
+        :param ionice: str or tuple - I/O class "idle", "best-effort" or "realtime", or (class, level)
+                       where level is 0 (highest) to 7 (lowest)
+        :param memory: int - limit of the address space in bytes
+        :param cpu_time: int - limit of CPU time in seconds, SIGXCPU is sent when reached
+        :param open_files: int - limit of open file descriptors
+        """
+        self.cpus = None if cpus is None else set(int(cpu) for cpu in cpus)
+        self.nice = nice
+        if ionice is None or isinstance(ionice, (tuple, list)):
+            self.ionice = ionice
+        else:
+            self.ionice = (ionice, 0)
+        if self.ionice is not None:
+            io_class, io_level = self.ionice
+            if io_class not in ioprio_classes:
+                raise ValueError("Unknown I/O class '{}'".format(io_class))
+            if io_level < 0 or io_level > 7:
+                raise ValueError("I/O level must be 0-7, got {}".format(io_level))
+        self.rlimits = []
+        for limit, value in ((resource.RLIMIT_AS, memory),
+                             (resource.RLIMIT_CPU, cpu_time),
+                             (resource.RLIMIT_NOFILE, open_files)):
+            if value is not None:
+                self.rlimits.append((limit, int(value)))
+
+    def apply(self):
+        """
+        Apply the settings to the current process
+        :return: None
+        """
+        if self.cpus is not None:
+            os.sched_setaffinity(0, self.cpus)
+        if self.nice is not None:
+            os.nice(self.nice)
+        if self.ionice is not None:
+            io_class, io_level = self.ionice
+            ioprio_syscall((ioprio_classes[io_class] << IOPRIO_CLASS_SHIFT) | io_level)
+        for limit, value in self.rlimits:
+            soft, hard = resource.getrlimit(limit)
+            if hard != resource.RLIM_INFINITY and value > hard:
+                raise ValueError("limit {} is above the hard limit {}".format(value, hard))
+            resource.setrlimit(limit, (value, hard))
+
+    @staticmethod
+    def effective():
+        """
+        Read the settings in effect for the current process
+        :return: list of (name, value) tuples
+        """
+        settings = [
+            ("cpus", ",".join(str(cpu) for cpu in sorted(os.sched_getaffinity(0)))),
+            ("nice", os.getpriority(os.PRIO_PROCESS, 0)),
+        ]
+        try:
+            value = ioprio_syscall()
+            io_classes = {number: name for name, number in ioprio_classes.items()}
+            io_class = io_classes.get(value >> IOPRIO_CLASS_SHIFT, "none")
+            settings.append(("ionice", "{},{}".format(io_class, value & ((1 << IOPRIO_CLASS_SHIFT) - 1))))
+        except OSError as exc:
+            settings.append(("ionice", "unknown ({})".format(exc)))
+        for name, limit in (("memory", resource.RLIMIT_AS),
+                            ("cpu_time", resource.RLIMIT_CPU),
+                            ("open_files", resource.RLIMIT_NOFILE)):
+            soft = resource.getrlimit(limit)[0]
+            settings.append((name, "unlimited" if soft == resource.RLIM_INFINITY else soft))
+        return settings
+
+    def apply_and_record(self, limits_file):
+        """
+        Apply the settings and write the effective ones to the limits file, one name=value per line
+        :param limits_file: str - path of the .limits file
+        :return: None
+        """
+        self.apply()
+        with open(limits_file, "w") as limits_fh:
+            for name, value in self.effective():
+                limits_fh.write("{}={}\n".format(name, value))
+
+
+class ResourceSampler:
+    """
+    Thread in the background process that periodically records memory, CPU time, context switches and
+    I/O bytes from /proc/self to a .usage.csv file, and writes a getrusage summary to a .rusage file when
+    the function is done. The /proc files are opened once and re-read from the start for each sample.
+    """
+
+    columns = ["elapsed", "rss_bytes", "user_time", "system_time", "voluntary_switches",
+               "involuntary_switches", "read_bytes", "write_bytes"]
+
+    def __init__(self, interval=1.0):
+        """
+        :param interval: float - seconds between samples
+        """
+        self.interval = interval
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.log_file_base = None
+        self.thread = None
+        self.stop_event = None
+
+    @staticmethod
+    def read_proc(fileno):
+        if fileno is None:
+            return ""
+        os.lseek(fileno, 0, os.SEEK_SET)
+        return os.read(fileno, 4096).decode()
+
+    @staticmethod
+    def open_proc(name):
+        try:
+            return os.open(os.path.join("/proc/self", name), os.O_RDONLY)
+        except OSError:
+            # /proc/self/io is not readable in some containers
+            return None
+
+    def sample(self, proc_files, start_time):
+        """
+        Read one sample
+        :param proc_files: tuple - file numbers of /proc/self stat, status and io
+        :param start_time: float - time the sampler started
+        :return: list - values in the order of columns
+        """
+        stat_fileno, status_fileno, io_fileno = proc_files
+        stat_fields = self.read_proc(stat_fileno).rpartition(")")[2].split()
+        values = {}
+        for line in (self.read_proc(status_fileno) + self.read_proc(io_fileno)).splitlines():
+            name, _, value = line.partition(":")
+            values[name] = value.strip()
+        return [
+            "{:.3f}".format(time.time() - start_time),
+            int(stat_fields[21]) * self.page_size,
+            "{:.2f}".format(int(stat_fields[11]) / self.clock_ticks),
+            "{:.2f}".format(int(stat_fields[12]) / self.clock_ticks),
+            values.get("voluntary_ctxt_switches", ""),
+            values.get("nonvoluntary_ctxt_switches", ""),
+            values.get("read_bytes", ""),
+            values.get("write_bytes", ""),
+        ]
+
+    def run(self, usage_file):
+        proc_files = tuple(self.open_proc(name) for name in ("stat", "status", "io"))
+        start_time = time.time()
+        try:
+            with open(usage_file, "w") as usage_fh:
+                usage_fh.write(",".join(self.columns) + "\n")
+                while True:
+                    usage_fh.write(",".join(str(value) for value in self.sample(proc_files, start_time)) + "\n")
+                    usage_fh.flush()
+                    if self.stop_event.wait(self.interval):
+                        # one last sample at the end
+                        usage_fh.write(",".join(str(value) for value in self.sample(proc_files, start_time)) + "\n")
+                        break
+        finally:
+            for fileno in proc_files:
+                if fileno is not None:
+                    os.close(fileno)
+
+    def start(self, log_file_base):
+        """
+        Start sampling the current process
+        :param log_file_base: str - path of the job files without extension
+        :return: None
+        """
+        self.log_file_base = log_file_base
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(log_file_base + ".usage.csv",),
+                                       name="ResourceSampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop sampling and write the getrusage summary of the process and its waited for children
+        :return: None
+        """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        with open(self.log_file_base + ".rusage", "w") as rusage_fh:
+            for who, usage in (("self", resource.getrusage(resource.RUSAGE_SELF)),
+                               ("children", resource.getrusage(resource.RUSAGE_CHILDREN))):
+                for name in ("ru_utime", "ru_stime", "ru_maxrss", "ru_minflt", "ru_majflt", "ru_inblock",
+                             "ru_oublock", "ru_nvcsw", "ru_nivcsw"):
+                    rusage_fh.write("{}.{}={}\n".format(who, name, getattr(usage, name)))
+
+
+def remove_pid_file(pid_file):
+    """
+    Remove the PID file at exit if it still belongs to this process
+    :param pid_file: str - path of the PID file
+    :return: None
+    """
+    try:
+        with open(pid_file) as pid_fh:
+            if int(pid_fh.read().strip()) != os.getpid():
+                return
+        os.remove(pid_file)
+    except (OSError, ValueError):
+        pass
+
+
+def daemonize(pid_file=None, work_dir="/", umask=0o022):
+    """
+    Detach the current (already forked) process from the parent session with the standard double fork:
+    start a new session so SIGHUP from the terminal no longer reaches it, fork again so it can never
+    reacquire a controlling terminal, then change directory, set the umask, read stdin from /dev/null
+    and write the PID file. Only the grandchild returns from this function.
+    :param pid_file: str - path of the file to write the daemon pid to, None for no PID file
+    :param work_dir: str - working directory for the daemon
+    :param umask: int - file mode creation mask for the daemon
+    :return: int - pid of the daemon
+    """
+    os.setsid()
+    if os.fork() > 0:
+        # First child is the session leader and exits so the daemon is not one
+        os._exit(0)
+    os.chdir(work_dir)
+    os.umask(umask)
+    with open(os.devnull, "r") as dev_null_fh:
+        os.dup2(get_file_no(dev_null_fh), get_file_no(sys.stdin))
+    pid = os.getpid()
+    if pid_file:
+        with open(pid_file, "w") as pid_fh:
+            pid_fh.write("{}\n".format(pid))
+        atexit.register(remove_pid_file, pid_file)
+    logger.debug("daemonized with pid {}".format(pid))
+    return pid
+
+
+def write_atomic(path, data, sync=False):
+    """
+    Replace a file with new contents so readers see either the old or the new contents, never a mix
+    :param path: str - file to replace
+    :param data: bytes - new contents
+    :param sync: bool - flush the data to disk before and after the rename so it survives a reboot
+    :return: None
+    """
+    temp_file = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_file, "wb") as temp_fh:
+        temp_fh.write(data)
+        if sync:
+            temp_fh.flush()
+            os.fsync(get_file_no(temp_fh))
+    os.replace(temp_file, path)
+    if sync:
+        dir_fileno = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(dir_fileno)
+        finally:
+            os.close(dir_fileno)
+
+
+def get_exit_code(status):
+    """
+    Convert a wait status from os.waitpid to an exit code. Negative values are the terminating signal.
+    :param status: int - wait status
+    :return: int - exit code
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def get_system_exit_code(exc):
+    """
+    Exit code of a SystemExit the way the interpreter would exit with it, 1 when the code is a message
+    :param exc: SystemExit exception
+    :return: int - exit code
+    """
+    return exc.code if isinstance(exc.code, int) else int(exc.code is not None)
+
+
+class JobStatus:
+    """
+    Status of a backgrounded job kept in a .status file next to its .out and .err files
+    """
+
+    def __init__(self, status_file, state="queued", pid=0, exit_code=0, start_time=0.0, end_time=0.0, progress=0):
+        self.status_file = status_file
+        self.state = state
+        self.pid = pid
+        self.exit_code = exit_code
+        self.start_time = start_time
+        self.end_time = end_time
+        self.progress = progress
+        self.progress_fd = None
+
+    @classmethod
+    def read(cls, status_file):
+        """
+        Read the status header, the pickled result is only loaded by the result method
+        :param status_file: str - path of the .status file
+        :return: JobStatus object
+        """
+        with open(status_file, "rb") as status_fh:
+            header = status_fh.read(STATUS_HEADER.size)
+        if len(header) < STATUS_HEADER.size:
+            raise ValueError("Truncated status file '{}'".format(status_file))
+        magic, state, pid, exit_code, start_time, end_time, progress = STATUS_HEADER.unpack(header)
+        if magic != STATUS_MAGIC:
+            raise ValueError("Not a job status file '{}'".format(status_file))
+        return cls(status_file, job_states[state], pid, exit_code, start_time, end_time, progress)
+
+    def write(self, result=None):
+        """
+        Atomically replace the status file with the current values and the pickled result
+        :param result: return value of the function
+        :return: None
+        """
+        try:
+            result_data = pickle.dumps(result)
+        except Exception as exc:
+            logger.warning("result of job can not be pickled: {}".format(exc))
+            result_data = pickle.dumps(None)
+        write_atomic(self.status_file, STATUS_HEADER.pack(
+            STATUS_MAGIC, job_states.index(self.state), self.pid, self.exit_code,
+            self.start_time, self.end_time, self.progress
+        ) + result_data)
+
+    def start(self):
+        """
+        Record that the job is running in this process and open the file for progress updates
+        :return: None
+        """
+        self.state = "running"
+        self.pid = os.getpid()
+        self.start_time = time.time()
+        self.write()
+        self.progress_fd = os.open(self.status_file, os.O_WRONLY)
+
+    def set_progress(self, value):
+        """
+        Update the progress counter in place with a single write
+        :param value: int - new progress value
+        :return: None
+        """
+        self.progress = int(value)
+        if self.progress_fd is not None:
+            os.pwrite(self.progress_fd, struct.pack("<q", self.progress), PROGRESS_OFFSET)
+
+    def finish(self, exit_code, result=None):
+        """
+        Record the end of the job with its exit code and result
+        :param exit_code: int - 0 for success
+        :param result: return value of the function
+        :return: None
+        """
+        if self.progress_fd is not None:
+            os.close(self.progress_fd)
+            self.progress_fd = None
+        self.state = "finished" if exit_code == 0 else "failed"
+        self.exit_code = exit_code
+        self.end_time = time.time()
+        self.write(result)
+
+    @property
+    def done(self):
+        return self.state in ("finished", "failed")
+
+    @property
+    def alive(self):
+        """
+        True if the job is recorded as running and its process still exists
+        """
+        if self.state != "running":
+            return False
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @property
+    def elapsed(self):
+        if not self.start_time:
+            return 0.0
+        return (self.end_time if self.done else time.time()) - self.start_time
+
+    def result(self):
+        """
+        Load the pickled return value of the function
+        :return: the result, None if the job has not finished
+        """
+        with open(self.status_file, "rb") as status_fh:
+            status_fh.seek(STATUS_HEADER.size)
+            data = status_fh.read()
+        return pickle.loads(data) if data else None
+
+    def __str__(self):
+        state = self.state
+        if state == "running" and not self.alive:
+            state = "died"
+        return "{} state={} pid={} exit_code={} progress={} elapsed={:.2f}s".format(
+            self.status_file, state, self.pid, self.exit_code if self.done else "-", self.progress, self.elapsed
+        )
+
+
+def set_progress(value):
+    """
+    Update the progress counter of the backgrounded job running in this process. Does nothing when
+    the function is not running in background, so it can always be called.
+    :param value: int - new progress value
+    :return: None
+    """
+    if current_job is not None:
+        current_job.set_progress(value)
+
+
+def get_stable_repr(value):
+    """
+    Text for a value that is the same in every interpreter run, unlike pickle or hash() which change with
+    PYTHONHASHSEED for sets and with object identity. Dicts and sets are sorted.
+    :param value: None, bool, int, float, str, bytes, path, or list, tuple, dict, set of these
+    :return: str
+    """
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return repr(value)
+    if isinstance(value, os.PathLike):
+        return "path({!r})".format(os.fspath(value))
+    if isinstance(value, (list, tuple)):
+        items = ",".join(get_stable_repr(item) for item in value)
+        return "[{}]".format(items) if isinstance(value, list) else "({})".format(items)
+    if isinstance(value, (set, frozenset)):
+        return "{{{}}}".format(",".join(sorted(get_stable_repr(item) for item in value)))
+    if isinstance(value, dict):
+        return "{{{}}}".format(",".join(sorted("{}:{}".format(get_stable_repr(k), get_stable_repr(v))
+                                               for k, v in value.items())))
+    raise TypeError("no stable representation for type {}".format(type(value).__name__))
+
+
+def get_checkpoint_file(log_dir, function_name, args, kwargs, checkpoint_key=None):
+    """
+    Determine the checkpoint file of a call. Unlike the other job files the name has no timestamp so a
+    re-launched job finds it. Different calls of the same function, e.g. in a pool, need their own
+    checkpoints, so the name includes the checkpoint key or else a digest of the arguments.
+    :param log_dir: str - directory for the file
+    :param function_name: str - name of the backgrounded function
+    :param args: tuple - positional arguments
+    :param kwargs: dict - keyword arguments
+    :param checkpoint_key: str, or a function called with the arguments of the call returning a str
+    :return: str - path of the .checkpoint file
+    """
+    script_name = str(sys.argv[0]).rpartition(os.path.sep)[2].rpartition(".")[0]
+    if callable(checkpoint_key):
+        checkpoint_key = checkpoint_key(*args, **kwargs)
+    if checkpoint_key is not None:
+        key = re.sub(r"[^\w.-]", "_", str(checkpoint_key))
+    else:
+        try:
+            key = hashlib.sha1(get_stable_repr((args, kwargs)).encode()).hexdigest()[:12]
+        except TypeError as exc:
+            raise ValueError("Can not derive a checkpoint name from the arguments of {} ({}), "
+                             "give a checkpoint_key".format(function_name, exc))
+    return os.path.abspath(os.path.join(log_dir, "{}_{}_{}.checkpoint".format(script_name, function_name, key)))
+
+
+def load_checkpoint(checkpoint_file):
+    """
+    Load the state saved by the last run of a job
+    :param checkpoint_file: str - path of the .checkpoint file
+    :return: the saved state, None if there is no checkpoint
+    """
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file, "rb") as checkpoint_fh:
+        return pickle.load(checkpoint_fh)
+
+
+def save_checkpoint(state, interval=0.0):
+    """
+    Persist a small state blob for the backgrounded job running in this process so it can be resumed
+    after a crash or reboot. The file is replaced atomically and synced to disk. Does nothing when the
+    function was not started with resume.
+    :param state: picklable state to pass back to the function when it is resumed
+    :param interval: float - skip the save if the last one was less than this many seconds ago, so it
+                     can be called for every item of a batch
+    :return: bool - True if the checkpoint was written
+    """
+    global last_checkpoint_time
+    if current_checkpoint_file is None:
+        return False
+    now = time.time()
+    if interval and now - last_checkpoint_time < interval:
+        return False
+    write_atomic(current_checkpoint_file, pickle.dumps(state), sync=True)
+    last_checkpoint_time = now
+    return True
+
+
+def call_function(function, args, kwargs):
+    """
+    Call the function, running coroutine functions to completion on a fresh event loop
+    :param function: the backgrounded function
+    :param args: tuple - positional arguments
+    :param kwargs: dict - keyword arguments
+    :return: the result of the function
+    """
+    if inspect.iscoroutinefunction(function):
+        return asyncio.run(function(*args, **kwargs))
+    return function(*args, **kwargs)
+
+
+def run_with_status(function, args, kwargs, status_file, checkpoint_file=None):
+    """
+    Call the function, recording its state, exit code and result in the status file
+    :param function: the backgrounded function
+    :param args: tuple - positional arguments
+    :param kwargs: dict - keyword arguments
+    :param status_file: str - path of the .status file
+    :param checkpoint_file: str - path of the .checkpoint file for save_checkpoint, removed on success
+    :return: the result of the function
+    """
+    global current_job, current_checkpoint_file
+    current_checkpoint_file = checkpoint_file
+    current_job = JobStatus(status_file)
+    current_job.start()
+    try:
+        result = call_function(function, args, kwargs)
+    except SystemExit as exc:
+        current_job.finish(get_system_exit_code(exc))
+        raise
+    except BaseException:
+        current_job.finish(1)
+        raise
+    current_job.finish(0, result)
+    current_checkpoint_file = None
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    return result
+
+
+def run_sampled(sampler, log_file_base, function, args, kwargs, checkpoint_file=None):
+    """
+    Call the function with its status recorded, sampling its resource usage when a sampler is given
+    :param sampler: ResourceSampler object or None
+    :param log_file_base: str - path of the job files without extension
+    :param function: the backgrounded function
+    :param args: tuple - positional arguments
+    :param kwargs: dict - keyword arguments
+    :param checkpoint_file: str - path of the .checkpoint file when resume is enabled
+    :return: the result of the function
+    """
+    if sampler is None:
+        return run_with_status(function, args, kwargs, log_file_base + ".status", checkpoint_file)
+    sampler.start(log_file_base)
+    try:
+        return run_with_status(function, args, kwargs, log_file_base + ".status", checkpoint_file)
+    finally:
+        sampler.stop()
+
+
+def wait_for_status(status_file, timeout=None, poll_interval=0.5):
+    """
+    Block until the job of the status file has finished or its process is gone
+    :param status_file: str - path of the .status file
+    :param timeout: float - seconds to wait, None waits forever
+    :param poll_interval: float - seconds between checks
+    :return: JobStatus object
+    """
+    end_time = None if timeout is None else time.time() + timeout
+    while True:
+        try:
+            status = JobStatus.read(status_file)
+        except FileNotFoundError:
+            # The parent logs the file name before the child writes it, the job has not started yet
+            status = None
+        if status is not None and (status.done or (status.state == "running" and not status.alive)):
+            return status
+        if end_time is not None and time.time() >= end_time:
+            raise TimeoutError("Timed out waiting for '{}'".format(status_file))
+        time.sleep(poll_interval)
+
+
+class BackgroundJob:
+    """
+    Handle for a function call queued in a BackgroundPool
+    """
+
+    def __init__(self, pool, function, args, kwargs, log_dir, capture=None, limits=None, sampler=None,
+                 checkpoint_file=None):
+        self.pool = pool
+        self.checkpoint_file = checkpoint_file
+        self.sampler = sampler
+        self.capture = capture
+        self.limits = limits
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.log_dir = log_dir
+        self.job_number = None
+        self.pid = None
+        self.log_file_base = None
+        self.output_log = None
+        self.error_log = None
+        self.status_file = None
+        self.exit_code = None
+
+    @property
+    def name(self):
+        return self.function.__name__
+
+    @property
+    def started(self):
+        return self.pid is not None
+
+    @property
+    def done(self):
+        return self.exit_code is not None
+
+    @property
+    def running(self):
+        return self.started and not self.done
+
+    def wait(self):
+        """
+        Block until this job has finished, starting queued jobs as slots free up
+        :return: int - the exit code of the job
+        """
+        while not self.done:
+            self.pool.poll()
+            if not self.done:
+                time.sleep(self.pool.poll_interval)
+        return self.exit_code
+
+    async def wait_async(self):
+        """
+        Wait for this job without blocking the event loop of the parent
+        :return: int - the exit code of the job
+        """
+        while not self.done:
+            self.pool.poll()
+            if not self.done:
+                await asyncio.sleep(self.pool.poll_interval)
+        return self.exit_code
+
+    def __await__(self):
+        """
+        Awaiting the job waits for it and returns the result of the function, None if the job failed
+        """
+        yield from self.wait_async().__await__()
+        return self.result()
+
+    def status(self):
+        """
+        Read the status file of the job
+        :return: JobStatus object, None if the job has not been queued
+        """
+        if self.status_file is None or not os.path.exists(self.status_file):
+            return None
+        return JobStatus.read(self.status_file)
+
+    def result(self):
+        """
+        Wait for the job and return the result of the function
+        :return: the result, None if the job failed
+        """
+        self.wait()
+        status = self.status()
+        return None if status is None else status.result()
+
+    def __repr__(self):
+        if self.done:
+            state = "exit_code={}".format(self.exit_code)
+        elif self.started:
+            state = "pid={}".format(self.pid)
+        else:
+            state = "queued"
+        return "<BackgroundJob {} {}>".format(self.name, state)
+
+
+class BackgroundPool:
+    """
+    Queue of function calls that are each run in a forked child, at most max_workers at a time.
+    Unlike run_in_background alone, the parent process keeps running and gets a BackgroundJob handle for
+    each call. Queued jobs are started and finished children are reaped whenever the parent calls
+    submit, poll or wait.
+    """
+
+    def __init__(self, max_workers=1, log_dir="", home_subdir="", poll_interval=0.1, capture=None, limits=None,
+                 sampler=None):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1, got {}".format(max_workers))
+        self.max_workers = max_workers
+        self.log_dir = get_log_dir(str(log_dir).strip().rstrip(os.path.sep),
+                                   str(home_subdir).strip().strip(os.path.sep))
+        self.poll_interval = poll_interval
+        self.capture = capture
+        self.limits = limits
+        self.sampler = sampler
+        self.queued = []
+        self.running = []
+        self.job_count = 0
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue a call to function to be run in a forked child
+        :return: BackgroundJob handle
+        """
+        return self.add_job(BackgroundJob(self, function, args, kwargs, self.log_dir, self.capture,
+                                          self.limits, self.sampler))
+
+    def add_job(self, job):
+        """
+        Queue an already created job and start it if a worker slot is free
+        :param job: BackgroundJob object
+        :return: BackgroundJob handle
+        """
+        self.job_count += 1
+        job.job_number = self.job_count
+        job.log_file_base = get_log_file_base(job.log_dir, job.name, job.job_number)
+        job.output_log = job.log_file_base + ".out"
+        job.error_log = job.log_file_base + ".err"
+        job.status_file = job.log_file_base + ".status"
+        JobStatus(job.status_file).write()
+        self.queued.append(job)
+        logger.debug("queued {}".format(job))
+        self.poll()
+        return job
+
+    def poll(self):
+        """
+        Reap finished children without blocking and start queued jobs in the free worker slots
+        :return: int - number of jobs queued or running
+        """
+        for job in list(self.running):
+            pid, status = os.waitpid(job.pid, os.WNOHANG)
+            if pid == job.pid:
+                job.exit_code = get_exit_code(status)
+                self.running.remove(job)
+                # A child killed by a signal could not record its own end
+                job_status = job.status()
+                if job_status is not None and not job_status.done:
+                    job_status.finish(job.exit_code)
+                logger.debug("reaped {}".format(job))
+        while self.queued and len(self.running) < self.max_workers:
+            self.start(self.queued.pop(0))
+        return len(self.queued) + len(self.running)
+
+    def wait(self):
+        """
+        Block until every queued and running job has finished
+        :return: None
+        """
+        while self.poll():
+            time.sleep(self.poll_interval)
+
+    async def wait_async(self):
+        """
+        Wait for every queued and running job without blocking the event loop of the parent
+        :return: None
+        """
+        while self.poll():
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self, job):
+        """
+        Fork a child for the job. The child redirects its output, runs the function and exits.
+        :param job: BackgroundJob object
+        :return: None
+        """
+        logger.info("stderr and stout will be directed to {} and {}".format(job.error_log, job.output_log))
+        # flush so pending parent output is not duplicated into the child
+        sys.stderr.flush()
+        sys.stdout.flush()
+        newpid = os.fork()
+        if newpid == 0:
+            exit_code = 0
+            try:
+                if job.capture is not None:
+                    job.capture.start(job.output_log, job.error_log)
+                else:
+                    redirect_output(job.output_log, job.error_log)
+                if job.limits is not None:
+                    job.limits.apply_and_record(job.log_file_base + ".limits")
+                logger.debug("from child: calling function {}".format(job.name))
+                run_sampled(job.sampler, job.log_file_base, job.function, job.args, job.kwargs,
+                            job.checkpoint_file)
+            except SystemExit as exc:
+                # sys.exit in the function, exit with its code like the interpreter would
+                if exc.code is not None and not isinstance(exc.code, int):
+                    print(exc.code, file=sys.stderr)
+                exit_code = get_system_exit_code(exc)
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                sys.stderr.flush()
+                sys.stdout.flush()
+                if job.capture is not None:
+                    job.capture.stop()
+                os._exit(exit_code)
+        job.pid = newpid
+        self.running.append(job)
+        logger.debug("started {}".format(job))
+
+
 def run_in_background(**decorator_kwargs):
     """
     Main decorator to run a python function in the background. stdout and stderr will be redicrected to
     unique files. Set logging to at least INFO level to have the location displayed at runtime.
+    Coroutine functions are run to completion on a new event loop in the background process.
     :param decorator_kwargs:
         log_dir=str     - full path to directory to place .out and .err redirected files. If neither
                           log_dir or hom_subdir, then files will be in users home directory
@@ -60,6 +1156,24 @@ def run_in_background(**decorator_kwargs):
         bg=bool, list, or str   - a list of strings that if NOT found in the system ARGV list will
                                   instead run in foreground. This gives capability for command line
                                   options to run in background. omit this list to always run in background.
+        pool=BackgroundPool     - queue the call in the pool instead of forking and exiting the parent.
+                                  The decorated function then returns a BackgroundJob handle. Logs go
+                                  to the pool log directory unless log_dir or home_subdir is given.
+        capture=LogCapture      - send stdout and stderr through a collector process that buffers, rotates
+                                  and compresses the .out and .err files instead of writing them directly
+        limits=JobLimits        - CPU affinity, nice and I/O priority and resource limits for the background
+                                  process. The effective settings are written to a .limits file.
+        sampler=ResourceSampler - record memory, CPU, context switch and I/O samples to a .usage.csv file
+                                  and a getrusage summary to a .rusage file
+        resume=bool     - pass the state last saved with save_checkpoint by an unfinished run of the same
+                          call to the function as the checkpoint keyword argument (None when there is
+                          none). The function must accept it. The checkpoint is removed on success.
+        checkpoint_key=str or function - names the checkpoint of a call, a function is called with the
+                          arguments of the call. By default the name is a digest of the arguments, which
+                          must then be built-in values (str, numbers, lists, dicts, sets, paths).
+        daemon=bool     - fully detach the background process (double fork, setsid, chdir to /, umask,
+                          stdin from /dev/null) and write its pid to a .pid file next to the .out and .err
+                          files. Relative paths used by the function will then resolve from /.
     :return: decorator
     """
     logger.debug("run_in_background outer decorator")
@@ -73,6 +1187,13 @@ def run_in_background(**decorator_kwargs):
         log_dir = ""
         home_subdir = ""
         bg_options = []
+        pool = None
+        daemon = False
+        capture = None
+        limits = None
+        sampler = None
+        resume = False
+        checkpoint_key = None
         for k, v in decorator_kwargs.items():
             if k == "home_subdir":
                 home_subdir = str(v).strip().strip(os.path.sep)
@@ -83,16 +1204,29 @@ def run_in_background(**decorator_kwargs):
                     bg_options = [v, ]
             elif k == "log_dir":
                 log_dir = str(v).strip().rstrip(os.path.sep)
+            elif k == "pool":
+                pool = v
+            elif k == "daemon":
+                daemon = bool(v)
+            elif k == "capture":
+                capture = v
+            elif k == "limits":
+                limits = v
+            elif k == "sampler":
+                sampler = v
+            elif k == "resume":
+                resume = bool(v)
+            elif k == "checkpoint_key":
+                checkpoint_key = v
             else:
                 raise ValueError("Unknown keyword '{}'".format(k))
+        if daemon and pool is not None:
+            raise ValueError("daemon can not be combined with pool--pool workers are reaped by the parent")
         #
-        # Determine the log directory
-        if log_dir:
-            pass
-        elif home_subdir:
-            log_dir = os.path.join(os.environ["HOME"], home_subdir)
-        else:
-            log_dir = os.environ["HOME"]
+        # Determine the log directory, a pool provides the default when neither was given
+        if pool is not None and not (log_dir or home_subdir):
+            log_dir = pool.log_dir
+        log_dir = get_log_dir(log_dir, home_subdir)
         logger.debug("log_dir='{}'".format(log_dir))
         #
         # Determine if background run
@@ -119,40 +1253,51 @@ def run_in_background(**decorator_kwargs):
             if not enable_background:
                 return bg_function(*args, **kwargs)
             #
-            # Determine the log file names
-            script_name = str(sys.argv[0]).rpartition(os.path.sep)[2].rpartition(".")[0]
-            log_file_base = "{}_{}_{}".format(script_name, bg_function.__name__, int(time.time() * 1000))
-            error_log = os.path.join(log_dir, log_file_base + ".err")
-            output_log = os.path.join(log_dir, log_file_base + ".out")
+            # Pick up the state of an unfinished earlier run
+            checkpoint_file = None
+            if resume:
+                if not os.path.exists(log_dir):
+                    os.makedirs(log_dir)
+                checkpoint_file = get_checkpoint_file(log_dir, bg_function.__name__, args, kwargs, checkpoint_key)
+                kwargs = dict(kwargs, checkpoint=load_checkpoint(checkpoint_file))
+                if kwargs["checkpoint"] is not None:
+                    logger.info("resuming {} from {}".format(bg_function.__name__, checkpoint_file))
+            #
+            # Queue in the pool when given, the parent keeps running
+            if pool is not None:
+                return pool.add_job(BackgroundJob(pool, bg_function, args, kwargs, log_dir,
+                                                  pool.capture if capture is None else capture,
+                                                  pool.limits if limits is None else limits,
+                                                  pool.sampler if sampler is None else sampler,
+                                                  checkpoint_file))
             #
-            # Redirect output
-            if not os.path.exists(log_dir):
-                os.makedirs(log_dir)
-                logger.debug("created new directory '{}'".format(log_dir))
+            # Determine the log file names
+            log_file_base = get_log_file_base(log_dir, bg_function.__name__)
+            output_log = log_file_base + ".out"
+            error_log = log_file_base + ".err"
             logger.debug("running {} in background".format(bg_function.__name__))
             logger.info("stderr and stout will be directed to {} and {}".format(error_log, output_log))
+            logger.info("job status will be kept in {}".format(log_file_base + ".status"))
+            JobStatus(log_file_base + ".status").write()
             #
             # Create a fork (child) process that will survive when parent exits
             newpid = os.fork()
             if newpid == 0:
-                # This is the child fork (pid is 0) so run the function
-                with open(output_log, "w") as file_out_fh:
-                    with open(error_log, "w") as file_err_fh:
-                        # determine filno for each
-                        stdout_fileno = get_file_no(sys.stdout)
-                        stderr_fileno = get_file_no(sys.stderr)
-                        out_fileno = get_file_no(file_out_fh)
-                        err_fileno = get_file_no(file_err_fh)
-                        # flush out and err so we don't miss any pending messages
-                        sys.stderr.flush()
-                        sys.stdout.flush()
-                        # redirect the sys out to the file out
-                        os.dup2(out_fileno, stdout_fileno)
-                        # redirect the sys err to the file err
-                        os.dup2(err_fileno, stderr_fileno)
-                        logger.debug("from child: calling function {}".format(bg_function.__name__))
-                        bg_function(*args, **kwargs)
+                # This is the child fork (pid is 0) so redirect output and run the function
+                if daemon:
+                    daemonize(log_file_base + ".pid")
+                if capture is not None:
+                    capture.start(output_log, error_log)
+                else:
+                    redirect_output(output_log, error_log)
+                if limits is not None:
+                    limits.apply_and_record(log_file_base + ".limits")
+                logger.debug("from child: calling function {}".format(bg_function.__name__))
+                run_sampled(sampler, log_file_base, bg_function, args, kwargs, checkpoint_file)
             else:
+                # Reap the first child, it exits as soon as the daemon has been forked
+                if daemon:
+                    os.waitpid(newpid, 0)
                 # If debug is on, wait a few seconds for debug logs from get_file_no function
                 if logger.getEffectiveLevel() == logging.DEBUG:
                     time.sleep(5)
@@ -162,3 +1307,54 @@ def run_in_background(**decorator_kwargs):
         return background_wrapper
 
     return background_decorator
+
+
+def get_options():
+    """
+    Parses the command line options
+    """
+    parser = argparse.ArgumentParser(description="Query jobs started by background_runner")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    status_parser = subparsers.add_parser("status", help="show the status of jobs")
+    status_parser.add_argument("paths", nargs="+",
+                               help=".status files or log directories to list all jobs")
+
+    wait_parser = subparsers.add_parser("wait", help="wait for a job, exiting with its exit code")
+    wait_parser.add_argument("status_file",
+                             help=".status file of the job")
+    wait_parser.add_argument("--timeout", type=float, required=False,
+                             help="seconds to wait before giving up")
+
+    for sub_parser in (status_parser, wait_parser):
+        sub_parser.add_argument("--result", action="store_true", required=False,
+                                help="also print the result of finished jobs")
+    return parser.parse_args()
+
+
+def main():
+
+    opt = get_options()
+
+    if opt.command == "wait":
+        status = wait_for_status(opt.status_file, opt.timeout)
+        statuses = [status]
+    else:
+        statuses = []
+        for path in opt.paths:
+            if os.path.isdir(path):
+                statuses.extend(JobStatus.read(f) for f in sorted(glob.glob(os.path.join(path, "*.status"))))
+            else:
+                statuses.append(JobStatus.read(path))
+
+    for status in statuses:
+        print(status)
+        if opt.result and status.state == "finished":
+            print("    result: {!r}".format(status.result()))
+
+    if opt.command == "wait":
+        sys.exit(status.exit_code if status.done else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#! python -u
+import logging
+import asyncio
+import argparse
+from background_runner import run_in_background, BackgroundPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("background_async")
+
+pool = BackgroundPool(max_workers=2, home_subdir="bg")
+
+
+def get_cmd_args():
+    parser = argparse.ArgumentParser(description="Example scripts for background_runner")
+    parser.add_argument('--debug', action="store_true", required=False)
+    return parser.parse_args()
+
+
+async def fetch(name, seconds):
+    await asyncio.sleep(seconds)
+    print("fetched {}".format(name))
+    return seconds
+
+
+# This is an example of decorating a coroutine function. Each call runs in a forked
+# child on its own event loop, many fetches running concurrently within it.
+@run_in_background(pool=pool)
+async def some_async_function(batch):
+    results = await asyncio.gather(*[fetch("{}-{}".format(batch, i), 1) for i in range(10)])
+    return sum(results)
+
+
+async def main_async():
+    jobs = [some_async_function(batch) for batch in range(4)]
+    # Awaiting a job handle returns the result of the function
+    totals = await asyncio.gather(*jobs)
+    print("totals: {}".format(totals))
+
+
+def main():
+    # get command line options
+    opt = get_cmd_args()
+    # set logging to debug if requested
+    if opt.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    logger.debug("started with args: {}".format(vars(opt)))
+    asyncio.run(main_async())
+
+
+if __name__ == '__main__':
+    main()
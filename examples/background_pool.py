@@ -0,0 +1,47 @@
+#! python -u
+import logging
+import time
+import argparse
+from background_runner import run_in_background, BackgroundPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("background_pool")
+
+# At most 3 jobs run at the same time, the rest wait in the queue
+pool = BackgroundPool(max_workers=3, home_subdir="bg")
+
+
+def get_cmd_args():
+    parser = argparse.ArgumentParser(description="Example scripts for background_runner")
+    parser.add_argument('--debug', action="store_true", required=False)
+    parser.add_argument('--jobs', type=int, default=10, required=False)
+    return parser.parse_args()
+
+
+# This is an example of decorating a function so each call is queued in the pool.
+# The call returns a job handle and the parent keeps running.
+@run_in_background(pool=pool)
+def some_pooled_function(job_number):
+    for i in range(5):
+        print("job {} iteration={}".format(job_number, i))
+        time.sleep(1)
+    print("job {} done!".format(job_number))
+
+
+def main():
+    # get command line options
+    opt = get_cmd_args()
+    # set logging to debug if requested
+    if opt.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    logger.debug("started with args: {}".format(vars(opt)))
+    # Queue the jobs
+    jobs = [some_pooled_function(n) for n in range(opt.jobs)]
+    # Wait for all of them to finish
+    pool.wait()
+    for job in jobs:
+        print("{} output in {}".format(job, job.output_log))
+
+
+if __name__ == '__main__':
+    main()
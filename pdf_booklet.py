@@ -1,8 +1,19 @@
 import PyPDF2
+import contextlib
+import re
+import hashlib
+import itertools
 import logging
 import argparse
+import os
+import threading
 import time
-from pdf_data import PdfData, page_sizes, get_units_from_parameter
+from io import BytesIO
+from PyPDF2.generic import StreamObject
+from pdf_data import page_sizes, get_units_from_parameter, hash_pdf_object, open_pdf_source, \
+    parse_page_ranges, get_page_selection
+from pdf_optimize import OptimizeStats, add_optimize_options, get_optimize_settings, optimize_page, \
+    write_optimized
 
 EPILOG = """
 PDF booklet generates booklet pages that can be folded and bound together to form a booklet.
@@ -22,33 +33,193 @@ The --signature parameter specifies the maximum number of pages in each signatur
 and must be a multiple of 4. If omitted, the entire PDF will be printed as a single signature. By printing
 the content into multiple signatures, this allows larger books to be bound that would normally not be
 able to be folded over with so many pages.
+
+Several input files can be given and are imposed as one book. Each input can select pages by appending a
+colon and a page range list, e.g. chapter1.pdf:1-10,15 or chapter2.pdf:3-. Inputs are only opened when
+their pages are needed and closed once they have all been imposed.
+
+The --cache parameter names a directory where the imposed pages of each signature are kept. On the next
+run only the signatures whose source pages or layout options changed are imposed again, the others are
+copied from the cache. The cache may be shared between documents and is never cleaned up automatically.
 """
+# Bump when a change to the imposition code makes cached signatures invalid
+CACHE_VERSION = 2
 opt = None
-logging.basicConfig(level=logging.INFO)
+re_source_argument = re.compile(r"^(?P<path>.+):(?P<pages>[\d,\- ]+)$")
 logger = logging.getLogger("pdf_booklet")
 
 
-class PdfSignatureReader(PyPDF2.PdfFileReader):
+class PdfSource:
+    """
+    One input of a booklet with an optional page selection. The PDF is only opened when its pages are needed
+    and can be closed as soon as all of its selected pages have been imposed.
+    """
+
+    def __init__(self, source, pages=None):
+        """
+        :param source: bytes, path or binary file object of the PDF
+        :param pages: str - page ranges to select, e.g. "1-10,15,20-", None for all pages
+        """
+        self.source = source
+        self.pages = pages
+        self.page_ranges = parse_page_ranges(pages)
+        self.exit_stack = None
+        self.reader = None
+        self.selection = None
+        self.pending = None
+
+    @property
+    def name(self):
+        if isinstance(self.source, (str, os.PathLike)):
+            return str(self.source)
+        return getattr(self.source, 'name', '<stream>')
+
+    @property
+    def is_open(self):
+        return self.reader is not None
+
+    @property
+    def page_count(self):
+        """
+        Number of selected pages. Only opens the PDF when a range runs to the end and closes it again, the
+        sources are counted before their pages are needed and must not all be open at once.
+        """
+        if self.selection is not None:
+            return len(self.selection)
+        if all(last is not None for first, last in self.page_ranges):
+            return sum(last - first + 1 for first, last in self.page_ranges)
+        self.open()
+        self.close()
+        return len(self.selection)
+
+    def open(self):
+        if self.reader is None:
+            self.exit_stack = contextlib.ExitStack()
+            self.reader = PyPDF2.PdfFileReader(self.exit_stack.enter_context(open_pdf_source(self.source)))
+            if self.selection is None:
+                self.selection = get_page_selection(self.page_ranges, self.reader.numPages)
+            logger.debug(f"Opened source PDF name={self.name} page_count={self.reader.numPages} "
+                         f"selected={len(self.selection)}")
+        return self.reader
+
+    def close(self):
+        if self.reader is not None:
+            self.reader = None
+            self.exit_stack.close()
+            logger.debug(f"Closed source PDF name={self.name}")
+
+    def reset(self):
+        """
+        Forgets the state of an earlier imposition so the source can be imposed again
+        """
+        self.close()
+        self.selection = None
+        self.pending = None
+
+    def get_page(self, index):
+        """
+        Gets a selected page without counting it as imposed
+        :param index: int - index into the selected pages
+        :return: PageObject
+        """
+        return self.open().getPage(self.selection[index])
+
+    def fetch_page(self, index):
+        """
+        Gets a selected page for imposition
+        :param index: int - index into the selected pages
+        :return: PageObject
+        """
+        page = self.get_page(index)
+        self.release(1)
+        return page
+
+    def release(self, count):
+        """
+        Counts pages as imposed
+        :param count: int - number of pages
+        :return: None
+        """
+        if self.pending is None:
+            self.pending = self.page_count
+        self.pending -= count
+
+    @property
+    def finished(self):
+        return self.pending is not None and self.pending <= 0
+
+
+class PdfSignature:
     """
-    Adds signature properties and methods to the PDFFileReader to allow reading page ranges defined by
-    each "signature" - Book binding term referring to page groups that are bound together.
+    Range of pages from the virtual page sequence of all the sources that makes up a "signature" - Book binding
+    term referring to page groups that are bound together.
     """
 
-    def __init__(self, start_page, end_page, *args, **kwargs):
+    def __init__(self, start_page, pages):
+        """
+        :param start_page: int - number of the first page in the virtual page sequence
+        :param pages: list of (PdfSource, index) tuples
+        """
         self.signature_start = start_page
-        self.signature_end = end_page
-        super().__init__(*args, **kwargs)
+        self.pages = pages
 
     @property
     def signature_page_count(self):
-        return (self.signature_end - self.signature_start) + 1
+        return len(self.pages)
 
-    def get_signature_page(self, pageNumber):
-        physical_page = pageNumber + self.signature_start
-        logger.debug(f"Signature page number called with {pageNumber} mapped to physical page {physical_page}")
-        if physical_page < self.signature_start or physical_page > self.signature_end:
+    @property
+    def signature_end(self):
+        return self.signature_start + self.signature_page_count - 1
+
+    def check_page_number(self, pageNumber):
+        if pageNumber < 0 or pageNumber >= self.signature_page_count:
             raise RuntimeError(f"Page {pageNumber} out of range ({self.signature_start} to {self.signature_end})")
-        return super().getPage(physical_page)
+
+    def get_signature_page(self, pageNumber):
+        """
+        Gets a page for imposition, counting it as imposed for its source
+        """
+        self.check_page_number(pageNumber)
+        logger.debug(f"Signature page number called with {pageNumber} mapped to virtual page "
+                     f"{pageNumber + self.signature_start}")
+        source, index = self.pages[pageNumber]
+        return source.fetch_page(index)
+
+    def release(self):
+        """
+        Counts every page as imposed, used when the imposed pages come from the cache
+        """
+        for source, index in self.pages:
+            source.release(1)
+
+
+class BookletOptions:
+    """
+    Layout and output options for impose, with the same names and defaults as the command line options
+    """
+
+    def __init__(self, paper='letter', blank=0, signature=0, hoffset=None, width=None, height=None, size='large',
+                 valign='center', cache=None, optimize='none', compress_level=None, drop_unused=None):
+        if paper not in page_sizes:
+            raise ValueError(f"paper must be one of {', '.join(page_sizes.keys())}, got '{paper}'")
+        if signature % 4 != 0:
+            raise ValueError(f"signature must be a multiple of 4, or 0 for a single signature, got {signature}")
+        if size not in ('large', 'small'):
+            raise ValueError(f"size must be large or small, got '{size}'")
+        if valign not in ('top', 'center', 'bottom'):
+            raise ValueError(f"Invalid valign value '{valign}'")
+        self.paper = paper
+        self.blank = blank
+        self.signature = signature
+        self.hoffset = hoffset
+        self.width = width
+        self.height = height
+        self.size = size
+        self.valign = valign
+        self.cache = cache
+        self.optimize = optimize
+        self.compress_level = compress_level
+        self.drop_unused = drop_unused
 
 
 def get_options():
@@ -61,8 +232,9 @@ def get_options():
     parser = argparse.ArgumentParser(description='Create PDF booklet', epilog=EPILOG)
 
     # Positional required arguments
-    parser.add_argument('file_in',
-                        help="Name of the input PDF file")
+    parser.add_argument('file_in', nargs='+',
+                        help="Name of the input PDF file, several to impose them as one book. "
+                             "Append :<pages> to select pages, e.g. chapter.pdf:1-10,15")
     parser.add_argument('file_out',
                         help="Name of the output PDF file")
 
@@ -83,44 +255,48 @@ def get_options():
                         help="Booklet size (default=large)")
     parser.add_argument('--valign', type=str, default='center', required=False,
                         help="vertical alignment when scaled: top, center, bottom (default=center)")
+    parser.add_argument('--cache', type=str, required=False,
+                        help="directory to cache imposed signatures for incremental rebuilds")
     parser.add_argument('--debug', action="store_true", dest='debug', required=False,
                         help="Additional features for debugging")
 
+    add_optimize_options(parser)
     opt = parser.parse_args()
 
     if opt.signature % 4 > 1:
         raise ValueError("signature argument must be a multiple of 4!")
 
 
-def determine_booklet_page_counts(sig_in):
+def determine_booklet_page_counts(sig_in, options):
     """
     Determines total pages needed and the front and back pointers needed for processing
     :param sig_in: PdfSignatureReader object
+    :param options: BookletOptions object
     :return: tuple - (front_pointer, back_pointer, output_page_count)
     """
-    target_pages = sig_in.signature_page_count + opt.blank
+    target_pages = sig_in.signature_page_count + options.blank
     front_pointer = 0
     back_pointer = target_pages - 1
     if target_pages % 4 > 0:
         back_pointer += 4 - target_pages % 4
     output_page_count = back_pointer + 1
-    logger.debug(f"source signature has {sig_in.signature_page_count} pages, add blank={opt.blank} "
+    logger.debug(f"source signature has {sig_in.signature_page_count} pages, add blank={options.blank} "
                  f"setting back_pointer to {back_pointer}")
     logger.debug(f"Signature will have {output_page_count} pages")
     return front_pointer, back_pointer, output_page_count
 
 
-def source_page_or_none(pdf_reader, page_number):
-    if page_number >= pdf_reader.signature_page_count:
+def page_number_or_none(sig_in, page_number):
+    if page_number >= sig_in.signature_page_count:
         return None
-    return pdf_reader.get_signature_page(page_number)
+    return page_number
 
 
-def get_translation_offset(source_page, target_width, target_height):
+def get_translation_offset(source_page, target_width, target_height, options, page_number):
 
     # Convert width and height adjusments from mm to units
-    width_adjust = get_units_from_parameter(opt.width)
-    height_adjust = get_units_from_parameter(opt.height)
+    width_adjust = get_units_from_parameter(options.width)
+    height_adjust = get_units_from_parameter(options.height)
 
     # Because of the decimal fixed point, we must now convert everything to float
     # when doing floating point arithmatic
@@ -135,37 +311,38 @@ def get_translation_offset(source_page, target_width, target_height):
 
     # Calculate x and y offsets to center the source page onto the section of the target page
     x_offset = round((target_width - page_width * scale) / 2)
-    if opt.valign == 'center':
+    if options.valign == 'center':
         y_offset = round((target_height - page_height * scale) / 2)
-    elif opt.valign == 'top':
+    elif options.valign == 'top':
         y_offset = round(target_height - page_height * scale)
-    elif opt.valign == 'bottom':
+    elif options.valign == 'bottom':
         y_offset = round(height_adjust / 2)
     else:
-        raise ValueError(f"Invalid valign value '{opt.valign}'")
+        raise ValueError(f"Invalid valign value '{options.valign}'")
 
     # Adjust for horizontal offset value
-    if opt.hoffset is not None:
-        if source_page.pdf.getPageNumber(source_page) % 2 > 0:
-            x_offset -= get_units_from_parameter(opt.hoffset)
+    if options.hoffset is not None:
+        if page_number % 2 > 0:
+            x_offset -= get_units_from_parameter(options.hoffset)
         else:
-            x_offset += get_units_from_parameter(opt.hoffset)
+            x_offset += get_units_from_parameter(options.hoffset)
 
     return x_offset, y_offset, scale
 
 
-def generate_large_booklet_pages(sig_in):
+def generate_large_booklet_pages(sig_in, options):
     """
     Generates a new 2-up PDF page for booklet printing
-    :param sig_in: Source PDF Reader object
+    :param sig_in: PdfSignature object
+    :param options: BookletOptions object
     :return: None
     """
 
-    front_pointer, back_pointer, output_page_count = determine_booklet_page_counts(sig_in)
+    front_pointer, back_pointer, output_page_count = determine_booklet_page_counts(sig_in, options)
 
     # Calculate output paper values
-    if opt.paper in page_sizes.keys():
-        source_width, source_height = page_sizes[opt.paper]
+    if options.paper in page_sizes.keys():
+        source_width, source_height = page_sizes[options.paper]
     else:
         raise ValueError("--paper option not valid")
     rotated_width = source_height
@@ -196,21 +373,23 @@ def generate_large_booklet_pages(sig_in):
 
         # Determine left/right page so that the front/back pages alternate
         if front_pointer % 2:
-            left_page = front_page
-            right_page = back_page
+            left_page, left_pointer = front_page, front_pointer
+            right_page, right_pointer = back_page, back_pointer
             logger.debug(f"Printing page {front_pointer + 1} and {back_pointer + 1}{source}")
         else:
-            left_page = back_page
-            right_page = front_page
+            left_page, left_pointer = back_page, back_pointer
+            right_page, right_pointer = front_page, front_pointer
             logger.debug(f"Printing page {back_pointer + 1}{source} and {front_pointer + 1}")
 
         if left_page is not None:
-            width_offset, height_offset, scale = get_translation_offset(left_page, tile_width, tile_height)
+            width_offset, height_offset, scale = get_translation_offset(left_page, tile_width, tile_height, options,
+                                                                        sig_in.signature_start + left_pointer)
             logger.debug(f"left: width_adjust={width_offset}, height_adjust={height_offset}, scale={scale}")
             target_page.mergeScaledTranslatedPage(left_page, scale, width_offset, height_offset)
 
         if right_page is not None:
-            width_offset, height_offset, scale = get_translation_offset(right_page, tile_width, tile_height)
+            width_offset, height_offset, scale = get_translation_offset(right_page, tile_width, tile_height, options,
+                                                                        sig_in.signature_start + right_pointer)
             logger.debug(f"right: width_adjust={width_offset}, height_adjust={height_offset}, scale={scale}")
             target_page.mergeScaledTranslatedPage(right_page, scale, rotated_width/2 + width_offset, height_offset)
 
@@ -220,17 +399,18 @@ def generate_large_booklet_pages(sig_in):
         front_pointer += 1
 
 
-def generate_small_booklet_pages(sig_in):
+def generate_small_booklet_pages(sig_in, options):
     """
     Generator function to yield each PDF page 8-up. Yields PDF Page ojbects
-    :param sig_in: PDFSignatureReader object
+    :param sig_in: PdfSignature object
+    :param options: BookletOptions object
     :return:
     """
     # Get the normal booklet layout pointers and page count
-    front_pointer, back_pointer, output_page_count = determine_booklet_page_counts(sig_in)
+    front_pointer, back_pointer, output_page_count = determine_booklet_page_counts(sig_in, options)
     # Calculate output paper values
-    if opt.paper in page_sizes.keys():
-        source_width, source_height = page_sizes[opt.paper]
+    if options.paper in page_sizes.keys():
+        source_width, source_height = page_sizes[options.paper]
     else:
         raise ValueError("--paper option not valid")
     rotated_width = source_height
@@ -252,7 +432,7 @@ def generate_small_booklet_pages(sig_in):
         sheets += 2
     logger.debug(f"Signature will be printed onto {sheets} sheets")
 
-    # Create a list of pages in booklet order
+    # Create a list of page numbers in booklet order. Pages are only fetched when placed.
     booklet_pages = []
     while front_pointer < back_pointer:
 
@@ -261,8 +441,8 @@ def generate_small_booklet_pages(sig_in):
             back_page_no = back_pointer - page_offset
             front_page_no = front_pointer + page_offset
             if front_page_no < back_page_no:
-                booklet_pages.append(source_page_or_none(sig_in, back_page_no))
-                booklet_pages.append(source_page_or_none(sig_in, front_page_no))
+                booklet_pages.append(page_number_or_none(sig_in, back_page_no))
+                booklet_pages.append(page_number_or_none(sig_in, front_page_no))
             else:
                 booklet_pages.extend((None, None))
 
@@ -271,8 +451,8 @@ def generate_small_booklet_pages(sig_in):
             back_page_no = back_pointer - page_offset
             front_page_no = front_pointer + page_offset
             if front_page_no < back_page_no:
-                booklet_pages.append(source_page_or_none(sig_in, front_page_no))
-                booklet_pages.append(source_page_or_none(sig_in, back_page_no))
+                booklet_pages.append(page_number_or_none(sig_in, front_page_no))
+                booklet_pages.append(page_number_or_none(sig_in, back_page_no))
             else:
                 booklet_pages.extend((None, None))
 
@@ -303,17 +483,19 @@ def generate_small_booklet_pages(sig_in):
                 if len(booklet_pages) < 1:
                     break
                 # Get the source page
-                source_page = booklet_pages.pop(0)
-                if source_page is None:
+                page_number = booklet_pages.pop(0)
+                if page_number is None:
                     logger.debug(f"Skipping empty location x={column} y={row} sheet={sheet + 1}")
                     continue
+                source_page = sig_in.get_signature_page(page_number)
                 # Get the offset from lower left point for tile location and the scale factor
-                x_offset, y_offset, scale = get_translation_offset(source_page, scaled_width, scaled_height)
+                x_offset, y_offset, scale = get_translation_offset(source_page, scaled_width, scaled_height, options,
+                                                                   sig_in.signature_start + page_number)
                 # Calculate x and y locations to center the source page onto the section of the target page
                 x_location = column + x_offset
                 y_location = row + y_offset
                 # Translate and scale onto the target page
-                logger.debug(f"Generating page {sig_in.getPageNumber(source_page) + 1} scale={scale:.2f} "
+                logger.debug(f"Generating page {sig_in.signature_start + page_number + 1} scale={scale:.2f} "
                               f"x={x_location} y={y_location} sheet={sheet + 1}")
                 target_page.mergeScaledTranslatedPage(source_page, scale, x_location, y_location)
 
@@ -321,75 +503,274 @@ def generate_small_booklet_pages(sig_in):
         yield target_page
 
 
-def generate_signatures(input_file):
+def generate_signatures(sources, options):
     """
-    Generates signatures of pages.  If the max signature was not specified or the total pages of the PDF
-    are <= the max signature then we can just yeild the pdf reader object.  Otherwise yield each
-    PDFSignatureReader object for each range of signature pages.
-    :param input_file:
+    Generates signatures of pages from the virtual page sequence of all the sources.  If the max signature
+    was not specified or the total pages are <= the max signature then a single signature holds every page.
+    Otherwise yield a PdfSignature object for each range of signature pages. The sources are counted as the
+    sequence reaches them. A source whose pages go into the signature built now is opened right away so
+    counting does not parse it twice, the signature size bounds the number of these open sources.
+    :param sources: list of PdfSource objects
+    :param options: BookletOptions object
     :return:
     """
 
-    pdf_in = PyPDF2.PdfFileReader(input_file)
+    if options.signature < 1:
+        logger.debug("signature option not supplied--single signature will be generated")
+    signature_number = 1
+    start_page = 0
+    pages = []
+    for source in sources:
+        if options.signature > 0:
+            source.open()
+        page_count = source.page_count
+        logger.debug(f"Source PDF name={source.name} selected pages={page_count}")
+        if page_count == 0:
+            source.close()
+        for index in range(page_count):
+            pages.append((source, index))
+            if len(pages) == options.signature:
+                logger.debug(f"Generating signature number {signature_number} from pages "
+                             f"{start_page}-{start_page + len(pages) - 1}")
+                yield PdfSignature(start_page, pages)
+                signature_number += 1
+                start_page += len(pages)
+                pages = []
+    if pages or start_page == 0:
+        logger.debug(f"Generating signature number {signature_number} from pages "
+                     f"{start_page}-{start_page + len(pages) - 1}")
+        yield PdfSignature(start_page, pages)
+    logger.debug(f"Virtual page sequence has {start_page + len(pages)} pages from {len(sources)} sources")
+    return
 
-    source_data = PdfData(pdf_in)
-    logger.debug(f"Source PDF name={opt.file_in} page_count={source_data.page_count}")
 
-    if opt.signature < 1:
-        logger.debug("signature option not supplied--single signature will be generated")
-        yield PdfSignatureReader(0, pdf_in.numPages - 1, input_file)
-    elif pdf_in.numPages <= opt.signature:
-        logger.debug("pages not greater than max signature--single signature will be generated")
-        yield PdfSignatureReader(0, pdf_in.numPages - 1, input_file)
+def get_signature_hash(sig_in, options):
+    """
+    Hashes the source pages of a signature (content, resources and page boxes) together with the layout
+    options, so an unchanged signature can be taken from the cache
+    :param sig_in: PdfSignature object
+    :param options: BookletOptions object
+    :return: str - hex digest
+    """
+    hasher = hashlib.sha256()
+    layout = (CACHE_VERSION, options.paper, options.blank, options.signature, options.hoffset, options.width,
+              options.height, options.size, options.valign, sig_in.signature_start, sig_in.signature_page_count)
+    hasher.update(repr(layout).encode())
+    # A source opened only for hashing is closed again after its pages so at most one of them is open.
+    # Each source gets its own visited objects, they are keyed by reader id which is reused once closed.
+    for source, source_pages in itertools.groupby(sig_in.pages, key=lambda page: page[0]):
+        was_open = source.is_open
+        visited = {}
+        for source, index in source_pages:
+            hash_pdf_object(source.get_page(index), hasher, visited)
+        if not was_open:
+            source.close()
+    return hasher.hexdigest()
+
+
+def save_cached_signature(cache_file, pages, sources):
+    """
+    Writes the imposed pages of a signature to the cache. Pages are detached as they are generated so
+    their sources are closed as soon as possible. The file is written under a temporary name and then
+    renamed so an interrupted run never leaves a partial cache entry.
+    :param cache_file: str - path of the cache entry
+    :param pages: iterable of PageObject
+    :param sources: list of PdfSource objects to close once their pages have been imposed
+    :return: int - most sources that were open at once
+    """
+    pdf_cache = PyPDF2.PdfFileWriter()
+    extern_map = {}
+    peak_open_count = 0
+    for page in pages:
+        pdf_cache.addPage(page)
+        detach_page(pdf_cache, page, extern_map)
+        peak_open_count = max(peak_open_count, close_finished_sources(sources, extern_map))
+    temp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_file, "wb") as cache_fh:
+        pdf_cache.write(cache_fh)
+    os.replace(temp_file, cache_file)
+    return peak_open_count
+
+
+def parse_source_argument(argument):
+    """
+    Splits a command line input of the form path[:page ranges]
+    :param argument: str
+    :return: PdfSource object
+    """
+    source_match = re_source_argument.match(argument)
+    if source_match and not os.path.exists(argument):
+        return PdfSource(source_match.group('path'), source_match.group('pages'))
+    return PdfSource(argument)
+
+
+def detach_page(pdf_out, page, extern_map):
+    """
+    Copies the objects of other PDFs that an added page refers to into the writer now instead of when it
+    is written, so the source PDFs can be closed. Uses the same PyPDF2 writer method as the final write.
+    /Parent is skipped as it points into the page tree of the writer itself.
+    A source must only be closed after all of its pages were detached: PyPDF2 turns objects it fails to
+    read from a closed file into null objects without an error, which would silently blank the page.
+    :param pdf_out: PdfFileWriter object the page was added to
+    :param page: PageObject
+    :param extern_map: dict - objects already copied, shared between calls so they are copied only once
+    :return: None
+    """
+    pdf_out.stack = []
+    for key, value in list(page.items()):
+        if key == "/Parent":
+            continue
+        value = pdf_out._sweepIndirectReferences(extern_map, value)
+        if isinstance(value, StreamObject):
+            value = pdf_out._addObject(value)
+        page[key] = value
+    del pdf_out.stack
+
+
+def close_finished_sources(sources, extern_map):
+    """
+    Closes the sources whose pages have all been imposed. Only call this after detach_page of the last
+    page, see detach_page. The copies made by detach_page are kept in extern_map by reader, they are
+    dropped so the reader can be freed.
+    :param sources: list of PdfSource objects
+    :param extern_map: dict - objects copied by detach_page
+    :return: int - number of sources that were open
+    """
+    open_count = 0
+    for source in sources:
+        if source.is_open:
+            open_count += 1
+            if source.finished:
+                extern_map.pop(source.reader, None)
+                source.close()
+    return open_count
+
+
+def write_booklet(sources, output_file, options):
+    """
+    Imposes the source PDFs as one book into booklet pages and writes them to the output
+    :param sources: list of PdfSource objects
+    :param output_file: binary file object supporting write and tell
+    :param options: BookletOptions object
+    :return: int - number of pages written
+    """
+    if options.size == 'large':
+        page_generator = generate_large_booklet_pages
+    elif options.size == 'small':
+        page_generator = generate_small_booklet_pages
     else:
-        signature_number = 1
-        for start_page in range(0, pdf_in.numPages, opt.signature):
-            if start_page + opt.signature - 1 >= pdf_in.numPages:
-                end_page = pdf_in.numPages - 1
-            else:
-                end_page = start_page + opt.signature - 1
-            logger.debug(f"Generating signature number {signature_number} from pages {start_page}-{end_page}")
-            yield PdfSignatureReader(start_page, end_page, input_file)
-            signature_number += 1
-    return
+        raise RuntimeError("Illegal page size")
+
+    if options.cache and not os.path.exists(options.cache):
+        os.makedirs(options.cache, exist_ok=True)
+
+    # Pages are optimized as they are added since detaching copies whatever they refer to at that point
+    level, recompress, drop_unused = get_optimize_settings(options.optimize, options.compress_level,
+                                                           options.drop_unused)
+    stats = OptimizeStats()
+
+    # Generate the new pages
+    page_count = 0
+    cached_count = 0
+    signature_count = 0
+    peak_open_count = 0
+    pdf_out = PyPDF2.PdfFileWriter()
+    extern_map = {}
+    with contextlib.ExitStack() as open_sources:
+        for source in sources:
+            source.reset()
+            open_sources.callback(source.close)
+        for sig_in in generate_signatures(sources, options):
+            signature_count += 1
+            with contextlib.ExitStack() as cache_files:
+                cache_reader = None
+                if not options.cache:
+                    pages = page_generator(sig_in, options)
+                else:
+                    cache_file = os.path.join(options.cache, get_signature_hash(sig_in, options) + ".pdf")
+                    if os.path.exists(cache_file):
+                        logger.debug(f"Signature {signature_count} unchanged, using {cache_file}")
+                        sig_in.release()
+                        cached_count += 1
+                    else:
+                        peak_open_count = max(peak_open_count, save_cached_signature(
+                            cache_file, page_generator(sig_in, options), sources))
+                    # New signatures are read back as well so the output is the same as from the cache
+                    cache_reader = PyPDF2.PdfFileReader(cache_files.enter_context(open(cache_file, "rb")))
+                    pages = cache_reader.pages
+                for page in pages:
+                    pdf_out.addPage(page)
+                    if level is not None or drop_unused:
+                        start_time = time.time()
+                        optimize_page(page, level, recompress, drop_unused, stats)
+                        stats.optimize_time += time.time() - start_time
+                    detach_page(pdf_out, page, extern_map)
+                    page_count += 1
+                    peak_open_count = max(peak_open_count, close_finished_sources(sources, extern_map))
+                # Every page of a cached signature has been detached, its file is closed leaving the block
+                extern_map.pop(cache_reader, None)
+
+        logger.debug(f"At most {peak_open_count} of {len(sources)} sources were open at once")
+        if options.cache:
+            logger.info(f"Reused {cached_count} of {signature_count} signatures from cache")
 
+        # Save the new file
+        logger.debug("Writing new pages to output file")
+        write_optimized(pdf_out, output_file, options.optimize, options.compress_level, options.drop_unused,
+                        stats)
 
-def main():
+    return page_count
 
-    global logger
 
-    start_time = time.time()
+def impose(source, options=None, output=None):
+    """
+    Library entry point to impose a PDF into a booklet without touching the file system. Uses no global
+    state so it can be called from several threads at once.
+    :param source: bytes, path or binary file object of the source PDF, a PdfSource object, or a list of
+                   these to impose several PDFs as one book. A file object must not be shared between
+                   threads, PdfSource objects can be as each call uses its own copy.
+    :param options: BookletOptions object, None for the defaults
+    :param output: binary file object to write the booklet to, None to return the booklet as bytes
+    :return: bytes when output is None, otherwise output
+    """
+    if options is None:
+        options = BookletOptions()
+    sources = source if isinstance(source, list) else [source]
+    sources = [PdfSource(s.source, s.pages) if isinstance(s, PdfSource) else PdfSource(s) for s in sources]
+    output_file = BytesIO() if output is None else output
+    write_booklet(sources, output_file, options)
+    return output_file.getvalue() if output is None else output
 
-    get_options()
 
-    if opt.debug:
-        logging.getLogger().setLevel(logging.DEBUG)
+def main():
 
-    # Input file context
-    with open(opt.file_in, 'rb') as input_file:
+    start_time = time.time()
 
-        if opt.size == 'large':
-            page_generator = generate_large_booklet_pages
-        elif opt.size == 'small':
-            page_generator = generate_small_booklet_pages
-        else:
-            raise RuntimeError("Illegal page size")
+    logging.basicConfig(level=logging.INFO)
 
-        # Generate the new pages
-        page_count = 0
-        pdf_out = PyPDF2.PdfFileWriter()
-        for sig_in in generate_signatures(input_file):
-            for page in page_generator(sig_in):
-                pdf_out.addPage(page)
-                page_count += 1
+    get_options()
 
-        # Save the new file
-        logger.debug("Writing new pages to output file")
-        with open(opt.file_out, "wb") as output_file:
-            pdf_out.write(output_file)
+    if opt.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
 
-        et = time.time() - start_time
-        logger.info(f"Processed {page_count} new pdf pages in {et:.2f}s")
+    # The inputs are only opened when their pages are needed, so check they exist before starting
+    sources = [parse_source_argument(argument) for argument in opt.file_in]
+    missing = [source.name for source in sources if not os.path.isfile(source.name)]
+    if missing:
+        raise FileNotFoundError(f"Input PDF not found: {', '.join(missing)}")
+
+    # Output file context, written under a temporary name so a failing input does not truncate the output
+    temp_file = f"{opt.file_out}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, "wb") as output_file:
+            page_count = write_booklet(sources, output_file, opt)
+        os.replace(temp_file, opt.file_out)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    et = time.time() - start_time
+    logger.info(f"Processed {page_count} new pdf pages in {et:.2f}s")
 
 
 if __name__ == '__main__':
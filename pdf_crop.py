@@ -1,10 +1,11 @@
 import logging
 import argparse
 import PyPDF2
-from pdf_data import get_units_from_parameter
+from io import BytesIO
+from pdf_data import get_units_from_parameter, open_pdf_source
+from pdf_optimize import add_optimize_options, write_optimized
 
 opt = None
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("pdf_crop")
 
 
@@ -35,55 +36,94 @@ def get_options():
     parser.add_argument('--debug', action="store_true", dest='debug',
                         required=False,
                         help="Additional features for debugging")
+    add_optimize_options(parser)
     opt = parser.parse_args()
 
 
+def get_margin_units(margin):
+    """
+    Converts a margin to PDF units
+    :param margin: str with a unit suffix of in, cm or mm, a number of PDF units, or None
+    :return: number
+    """
+    if margin is None or isinstance(margin, (int, float)):
+        return margin or 0
+    return get_units_from_parameter(margin)
+
+
+def crop_pages(input_file, output_file, margins, optimize='none', compress_level=None, drop_unused=None):
+    """
+    Crops each margin of every page of the source PDF and writes the pages to the output
+    :param input_file: binary file object of the source PDF
+    :param output_file: binary file object supporting write and tell
+    :param margins: dict - amount to crop for any of the keys left, right, top and bottom
+    :param optimize: str - output optimization preset
+    :param compress_level: int - Flate level overriding the preset
+    :param drop_unused: bool - overrides the preset resource removal when not None
+    :return: int - number of pages written
+    """
+    unknown = set(margins) - {'left', 'right', 'top', 'bottom'}
+    if unknown:
+        raise ValueError(f"Unknown margins {', '.join(sorted(unknown))}")
+    left_units = get_margin_units(margins.get('left'))
+    right_units = get_margin_units(margins.get('right'))
+    top_units = get_margin_units(margins.get('top'))
+    bottom_units = get_margin_units(margins.get('bottom'))
+
+    pdf_in = PyPDF2.PdfFileReader(input_file)
+    pdf_out = PyPDF2.PdfFileWriter()
+
+    for page in pdf_in.pages:
+        left, bottom = page.mediaBox.lowerLeft
+        right, top = page.mediaBox.upperRight
+        left += left_units
+        right -= right_units
+        top -= top_units
+        bottom += bottom_units
+        page.mediaBox.setLowerLeft((left, bottom))
+        page.mediaBox.setUpperRight((right, top))
+        pdf_out.addPage(page)
+
+    # Save the new file
+    logger.debug("Writing new pages to output file")
+    write_optimized(pdf_out, output_file, optimize, compress_level, drop_unused)
+    return pdf_out.getNumPages()
+
+
+def crop(source, margins, output=None, optimize='none', compress_level=None, drop_unused=None):
+    """
+    Library entry point to crop a PDF without touching the file system. Uses no global state so it can
+    be called from several threads at once.
+    :param source: bytes, path or binary file object of the source PDF
+    :param margins: dict - amount to crop for any of the keys left, right, top and bottom, as a str with a
+                    unit suffix of in, cm or mm or a number of PDF units
+    :param output: binary file object to write the cropped PDF to, None to return it as bytes
+    :param optimize: str - output optimization preset
+    :param compress_level: int - Flate level overriding the preset
+    :param drop_unused: bool - overrides the preset resource removal when not None
+    :return: bytes when output is None, otherwise output
+    """
+    output_file = BytesIO() if output is None else output
+    with open_pdf_source(source) as input_file:
+        crop_pages(input_file, output_file, margins, optimize, compress_level, drop_unused)
+    return output_file.getvalue() if output is None else output
+
+
 def main():
 
+    logging.basicConfig(level=logging.INFO)
+
     get_options()
 
     if opt.debug:
         logging.getLogger().setLevel(logging.DEBUG)
 
-    found_param = False
-    left_units = 0
-    right_units = 0
-    top_units = 0
-    bottom_units = 0
-    if opt.left:
-        left_units = get_units_from_parameter(opt.left)
-        found_param = True
-    if opt.right:
-        right_units = get_units_from_parameter(opt.right)
-        found_param = True
-    if opt.top:
-        top_units = get_units_from_parameter(opt.top)
-        found_param = True
-    if opt.bottom:
-        bottom_units = get_units_from_parameter(opt.bottom)
-        found_param = True
-
-    # Input file context
-    with open(opt.file_in, 'rb') as input_file:
+    margins = {'left': opt.left, 'right': opt.right, 'top': opt.top, 'bottom': opt.bottom}
 
-        pdf_in = PyPDF2.PdfFileReader(input_file)
-        pdf_out = PyPDF2.PdfFileWriter()
-
-        for page in pdf_in.pages:
-            left, bottom = page.mediaBox.lowerLeft
-            right, top = page.mediaBox.upperRight
-            left += left_units
-            right -= right_units
-            top -= top_units
-            bottom += bottom_units
-            page.mediaBox.setLowerLeft((left, bottom))
-            page.mediaBox.setUpperRight((right, top))
-            pdf_out.addPage(page)
-
-        # Save the new file
-        logger.debug("Writing new pages to output file")
+    # Input and output file context
+    with open(opt.file_in, 'rb') as input_file:
         with open(opt.file_out, "wb") as output_file:
-            pdf_out.write(output_file)
+            crop_pages(input_file, output_file, margins, opt.optimize, opt.compress_level, opt.drop_unused)
 
 
 if __name__ == '__main__':
@@ -1,8 +1,13 @@
+import os
 import re
+from contextlib import contextmanager
+from io import BytesIO
+from PyPDF2.generic import ArrayObject, DictionaryObject, EncodedStreamObject, IndirectObject, StreamObject
 
 units_per_mm = 420.0 / 148.0
 units_per_inch = 612.0 / 8.5
 re_units = re.compile("(?P<value>[+\-]?[\d]*\.?[\d]+)(?P<suffix>cm|mm|in)")
+re_page_range = re.compile(r"^(?P<first>\d+)?(?P<dash>-)?(?P<last>\d+)?$")
 page_sizes = {
     'letter':  (612, 792),
     'legal':   (612, 1008),
@@ -34,6 +39,104 @@ def get_units_from_parameter(param):
         raise RuntimeError("Script error: non-supported option")
 
 
+def parse_page_ranges(spec):
+    """
+    Parses a page selection such as "1-10,15,20-" with 1 based page numbers. A range without a first
+    page starts at page 1, a range without a last page runs to the end of the document.
+    :param spec: str or None for all pages
+    :return: list of (first, last) tuples, last is None for the end of the document
+    """
+    if spec is None or not str(spec).strip():
+        return [(1, None)]
+    page_ranges = []
+    for part in str(spec).split(","):
+        range_match = re_page_range.match(part.strip())
+        if not range_match or not (range_match.group('first') or range_match.group('last')):
+            raise ValueError(f"Unable to parse page range '{part}'")
+        first = int(range_match.group('first') or 1)
+        if range_match.group('dash'):
+            last = int(range_match.group('last')) if range_match.group('last') else None
+        else:
+            last = first
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f"Invalid page range '{part}'")
+        page_ranges.append((first, last))
+    return page_ranges
+
+
+def get_page_selection(page_ranges, page_count):
+    """
+    Converts parsed page ranges to the list of selected 0 based page numbers
+    :param page_ranges: list of (first, last) tuples from parse_page_ranges
+    :param page_count: int - number of pages in the document
+    :return: list of int
+    """
+    selection = []
+    for first, last in page_ranges:
+        last = page_count if last is None else last
+        if first > page_count or last > page_count:
+            raise ValueError(f"Page range {first}-{last} is beyond the last page {page_count}")
+        selection.extend(range(first - 1, last))
+    return selection
+
+
+@contextmanager
+def open_pdf_source(source):
+    """
+    Context manager giving a binary file object for a PDF given as bytes, a path or a file object.
+    Files opened here are closed on exit, file objects passed in are left open.
+    :param source: bytes, str/PathLike path or binary file object
+    :return: binary file object
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield BytesIO(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as source_file:
+            yield source_file
+    else:
+        yield source
+
+
+def hash_pdf_object(obj, hasher, visited=None):
+    """
+    Feeds the content of a PDF object, following indirect references, into a hashlib object. Object
+    numbers are not hashed so the same content gives the same hash after the file has been rewritten.
+    /Parent entries are skipped so hashing a page does not pull in the whole page tree.
+    :param obj: PDF object
+    :param hasher: hashlib object to update
+    :param visited: dict - indirect references already hashed, used to break reference cycles
+    :return: None
+    """
+    if visited is None:
+        visited = {}
+    if isinstance(obj, IndirectObject):
+        key = (id(obj.pdf), obj.idnum, obj.generation)
+        if key in visited:
+            hasher.update(f"R{visited[key]}".encode())
+            return
+        visited[key] = len(visited)
+        obj = obj.getObject()
+    if isinstance(obj, DictionaryObject):
+        hasher.update(b"<<")
+        for key in sorted(obj.keys()):
+            if key == "/Parent":
+                continue
+            hasher.update(key.encode())
+            hash_pdf_object(obj.raw_get(key), hasher, visited)
+        hasher.update(b">>")
+        if isinstance(obj, StreamObject):
+            hasher.update(obj._data if isinstance(obj, EncodedStreamObject) else obj.getData())
+    elif isinstance(obj, ArrayObject):
+        hasher.update(b"[")
+        for item in obj:
+            hash_pdf_object(item, hasher, visited)
+        hasher.update(b"]")
+    else:
+        stream = BytesIO()
+        obj.writeToStream(stream, None)
+        hasher.update(stream.getvalue() + b" ")
+
+
 class PdfData:
 
     def __init__(self, pdf_reader):
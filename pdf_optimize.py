@@ -0,0 +1,204 @@
+import logging
+import time
+import zlib
+import PyPDF2
+from PyPDF2.generic import ArrayObject, DictionaryObject, EncodedStreamObject, NameObject
+
+logger = logging.getLogger("pdf_optimize")
+
+# Preset name: (flate level, recompress already filtered streams, drop unused resources)
+# "speed" only compresses content streams that are still raw (e.g. pages built by merging) using a
+# cheap level.  "size" decodes and recompresses every content stream at the best level and removes
+# resources that the page content never references so they are not copied into the output.
+optimize_presets = {
+    'none':  (None, False, False),
+    'speed': (1, False, False),
+    'size':  (9, True, True),
+}
+
+# Content stream operators whose first operand names a page resource, mapped to the resource category
+resource_operators = {
+    b"Do": "/XObject",
+    b"Tf": "/Font",
+    b"gs": "/ExtGState",
+    b"sh": "/Shading",
+}
+
+
+class OptimizeStats:
+    """
+    Counters collected while optimizing and writing a PDF
+    """
+
+    def __init__(self):
+        self.content_bytes_in = 0
+        self.content_bytes_out = 0
+        self.streams_compressed = 0
+        self.resources_dropped = 0
+        self.output_bytes = 0
+        self.optimize_time = 0.0
+        self.write_time = 0.0
+
+    @property
+    def content_bytes_saved(self):
+        """
+        Bytes saved by recompressing content streams only, dropped resources are not included
+        """
+        return self.content_bytes_in - self.content_bytes_out
+
+    def __str__(self):
+        return (f"wrote {self.output_bytes} bytes, content streams {self.content_bytes_in} -> "
+                f"{self.content_bytes_out} bytes (saved {self.content_bytes_saved}, "
+                f"{self.streams_compressed} streams compressed, "
+                f"{self.resources_dropped} resources dropped), "
+                f"optimize={self.optimize_time:.2f}s write={self.write_time:.2f}s")
+
+
+def add_optimize_options(parser):
+    """
+    Adds the output optimization options to a command line parser
+    :param parser: argparse.ArgumentParser object
+    :return: None
+    """
+    parser.add_argument('--optimize', type=str, default='none', required=False,
+                        choices=optimize_presets.keys(),
+                        help="output optimization favoring speed or size (default=none)")
+    parser.add_argument('--compress-level', type=int, dest='compress_level', required=False,
+                        help="Flate level 0-9 for content streams (overrides --optimize)")
+    parser.add_argument('--drop-unused', action="store_true", dest='drop_unused', default=None, required=False,
+                        help="remove page resources not referenced by the page content")
+
+
+def get_stream_size(stream):
+    """
+    Size of a content stream as it would currently be stored in the output
+    :param stream: StreamObject or ArrayObject of StreamObjects
+    :return: int
+    """
+    stream = stream.getObject()
+    if isinstance(stream, ArrayObject):
+        return sum(get_stream_size(s) for s in stream)
+    if isinstance(stream, EncodedStreamObject):
+        return len(stream._data)
+    return len(stream.getData())
+
+
+def drop_unused_resources(page, content):
+    """
+    Replaces the page resource dictionary with a copy that only holds the named resources used by
+    the content stream. The original dictionary may be shared by other pages so it is not modified.
+    :param page: PageObject
+    :param content: parsed ContentStream of the page
+    :return: int - number of resources dropped
+    """
+    if "/Resources" not in page:
+        return 0
+    used = {category: set() for category in resource_operators.values()}
+    for operands, operator in content.operations:
+        category = resource_operators.get(operator)
+        if category is not None and operands:
+            used[category].add(operands[0])
+    dropped = 0
+    resources = page["/Resources"].getObject()
+    new_resources = DictionaryObject()
+    for category, value in resources.items():
+        if category in used:
+            entries = value.getObject()
+            kept = DictionaryObject()
+            for name, entry in entries.items():
+                if name in used[category]:
+                    kept[name] = entry
+            dropped += len(entries) - len(kept)
+            value = kept
+        new_resources[category] = value
+    page[NameObject("/Resources")] = new_resources
+    return dropped
+
+
+def optimize_page(page, level, recompress, drop_unused, stats):
+    """
+    Compresses the content streams of a page and optionally drops unused resources
+    :param page: PageObject
+    :param level: int - Flate level or None to leave content streams alone
+    :param recompress: bool - also decode and recompress streams that already have a filter
+    :param drop_unused: bool - remove resources the content does not reference
+    :param stats: OptimizeStats object to update
+    :return: None
+    """
+    contents = page.getContents()
+    if contents is None:
+        return
+    raw = not isinstance(contents, ArrayObject) and "/Filter" not in contents
+    compress = level is not None and (raw or recompress)
+    if not compress and not drop_unused:
+        return
+    content = contents
+    if not isinstance(content, PyPDF2.pdf.ContentStream):
+        content = PyPDF2.pdf.ContentStream(contents, page.pdf)
+    if drop_unused:
+        stats.resources_dropped += drop_unused_resources(page, content)
+    if compress:
+        size_in = get_stream_size(contents)
+        data = zlib.compress(content.getData(), level)
+        stats.content_bytes_in += size_in
+        # Keep the stored stream when recompressing does not make it smaller
+        if len(data) >= size_in:
+            stats.content_bytes_out += size_in
+            return
+        stream = EncodedStreamObject()
+        stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+        stream._data = data
+        page[NameObject("/Contents")] = stream
+        stats.content_bytes_out += len(data)
+        stats.streams_compressed += 1
+
+
+def get_optimize_settings(preset='none', compress_level=None, drop_unused=None):
+    """
+    Resolves the optimize options to the settings used by optimize_page
+    :param preset: str - key of optimize_presets
+    :param compress_level: int - Flate level 0-9 overriding the preset
+    :param drop_unused: bool - overrides the preset resource removal when not None
+    :return: tuple of (level, recompress, drop_unused)
+    """
+    if preset not in optimize_presets:
+        raise ValueError(f"Invalid optimize preset '{preset}'")
+    level, recompress, preset_drop_unused = optimize_presets[preset]
+    if compress_level is not None:
+        if compress_level < 0 or compress_level > 9:
+            raise ValueError(f"compress level must be 0-9, got {compress_level}")
+        level = compress_level
+    if drop_unused is None:
+        drop_unused = preset_drop_unused
+    return level, recompress, drop_unused
+
+
+def write_optimized(pdf_out, output_file, preset='none', compress_level=None, drop_unused=None, stats=None):
+    """
+    Optimizes the pages of a PDF writer according to the preset and writes it to the output file
+    :param pdf_out: PdfFileWriter object
+    :param output_file: binary file object supporting write and tell
+    :param preset: str - key of optimize_presets
+    :param compress_level: int - Flate level 0-9 overriding the preset
+    :param drop_unused: bool - overrides the preset resource removal when not None
+    :param stats: OptimizeStats object of pages the caller already optimized with optimize_page, they
+                  are then only written
+    :return: OptimizeStats object
+    """
+    level, recompress, drop_unused = get_optimize_settings(preset, compress_level, drop_unused)
+    if stats is None:
+        stats = OptimizeStats()
+        start_time = time.time()
+        if level is not None or drop_unused:
+            for page_number in range(pdf_out.getNumPages()):
+                optimize_page(pdf_out.getPage(page_number), level, recompress, drop_unused, stats)
+        stats.optimize_time = time.time() - start_time
+
+    start_time = time.time()
+    start_position = output_file.tell()
+    pdf_out.write(output_file)
+    stats.output_bytes = output_file.tell() - start_position
+    stats.write_time = time.time() - start_time
+
+    logger.info(f"Output {stats}")
+    return stats